@@ -2,8 +2,12 @@
 
 import logging
 import os
+import random
 import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -24,11 +28,38 @@ except ImportError:
     print("Error: chromadb is not installed. Install it with: pip install chromadb")
     sys.exit(1)
 
+try:
+    from openai import OpenAI
+except ImportError:
+    print("Error: openai is not installed. Install it with: pip install openai")
+    sys.exit(1)
+
+try:
+    import tiktoken
+except ImportError:
+    print("Error: tiktoken is not installed. Install it with: pip install tiktoken")
+    sys.exit(1)
+
 DOCS_DIR = Path(__file__).resolve().parent.parent / "docs"
 CHROMA_DIR = Path(__file__).resolve().parent.parent / "chroma_db"
 COLLECTION_NAME = "internal_docs"
+CHROMA_HOST = os.environ.get("CHROMA_HOST")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
 MAX_CHUNK_CHARS = 1500
+MAX_CHUNK_TOKENS = 8000  # OpenAI embedding models reject inputs over 8191 tokens
+UPSERT_BATCH_SIZE = 100  # Chroma's recommended batch size
+UPSERT_WORKERS = 4
+# OpenAI accepts up to 2048 inputs per embeddings call and caps the total
+# tokens per request at 300k; batches are bounded by both, with headroom.
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_TOKENS = 250_000
+EMBED_WORKERS = 4
+IO_WORKERS = int(os.environ.get("INGEST_IO_WORKERS", "16"))
+
+_HEADING_RE = re.compile(r"^(## .+)$", re.MULTILINE)
+# A "# Title" line (exactly one #), ignoring surrounding whitespace
+_TITLE_RE = re.compile(r"^[ \t]*(# [^\n]*\S)", re.MULTILINE)
 
 
 def load_markdown_files(docs_dir: Path) -> list[dict]:
@@ -36,14 +67,26 @@ def load_markdown_files(docs_dir: Path) -> list[dict]:
 
     Returns a list of dicts with keys: ``filename``, ``relative_path``, ``content``.
     """
-    documents = []
-    for md_file in sorted(docs_dir.glob("**/*.md")):
-        text = md_file.read_text(encoding="utf-8")
-        documents.append({
-            "filename": md_file.name,
-            "relative_path": str(md_file.relative_to(docs_dir)),
-            "content": text,
-        })
+    md_files = sorted(
+        Path(root) / name
+        for root, _dirs, names in os.walk(docs_dir)
+        for name in names
+        if name.endswith(".md")
+    )
+    if not md_files:
+        return []
+
+    # Reads are I/O-bound, so overlap them; map() keeps results in input order
+    with ThreadPoolExecutor(max_workers=max(1, min(IO_WORKERS, len(md_files)))) as executor:
+        texts = executor.map(lambda f: f.read_text(encoding="utf-8"), md_files)
+
+        documents = []
+        for md_file, text in zip(md_files, texts):
+            documents.append({
+                "filename": md_file.name,
+                "relative_path": str(md_file.relative_to(docs_dir)),
+                "content": text,
+            })
     return documents
 
 
@@ -54,8 +97,7 @@ def _split_by_headings(text: str) -> list[tuple[str, str]]:
     content before the first ``## `` heading (e.g. front-matter or the
     ``# Title`` line).
     """
-    pattern = re.compile(r"^(## .+)$", re.MULTILINE)
-    parts = pattern.split(text)
+    parts = _HEADING_RE.split(text)
 
     sections: list[tuple[str, str]] = []
     # parts alternates: [pre-text, heading1, body1, heading2, body2, ...]
@@ -74,11 +116,8 @@ def _split_by_headings(text: str) -> list[tuple[str, str]]:
 
 def _extract_title(text: str) -> str:
     """Return the first ``# Title`` line (not ##) or empty string."""
-    for line in text.splitlines():
-        stripped = line.strip()
-        if stripped.startswith("# ") and not stripped.startswith("## "):
-            return stripped
-    return ""
+    match = _TITLE_RE.search(text)
+    return match.group(1) if match else ""
 
 
 def _split_section_by_paragraphs(
@@ -95,10 +134,15 @@ def _split_section_by_paragraphs(
     if heading:
         prefix += heading + "\n\n"
 
-    paragraphs = re.split(r"\n{2,}", section_text)
+    # A plain split is enough: extra newlines from 3+ newline runs end up as
+    # leading whitespace or empty pieces, which the strip below removes.
+    paragraphs = section_text.split("\n\n")
     chunks: list[str] = []
+    append = chunks.append
     current = prefix
 
+    # Paragraphs are non-empty after stripping, so ``current != prefix``
+    # means at least one paragraph has been added to the pending chunk.
     for para in paragraphs:
         para = para.strip()
         if not para:
@@ -107,25 +151,76 @@ def _split_section_by_paragraphs(
         if len(candidate) <= max_chars:
             current = candidate
         else:
-            if current.strip() != prefix.strip():
-                chunks.append(current.strip())
+            if current != prefix:
+                append(current.strip())
             current = prefix + para + "\n\n"
 
-    if current.strip() and current.strip() != prefix.strip():
-        chunks.append(current.strip())
+    if current != prefix:
+        append(current.strip())
 
     return chunks if chunks else [section_text.strip()]
 
 
-def chunk_markdown(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list[dict]:
+@lru_cache(maxsize=1)
+def _encoding() -> "tiktoken.Encoding":
+    """Return the tokenizer for ``EMBEDDING_MODEL`` (loaded on first use)."""
+    try:
+        return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _split_by_tokens(text: str, max_tokens: int, prefix: str = "") -> list[str]:
+    """Split ``text`` into pieces of at most ``max_tokens`` embedding tokens.
+
+    Every piece starts with ``prefix`` (the title/heading context), whose
+    tokens are reserved from each piece's budget. Cuts are backed off to a
+    UTF-8 character boundary so no piece contains a split character.
+
+    A chunk's token count never exceeds its UTF-8 byte length, so ordinary
+    chunks are returned as-is without tokenizing. Only oversized ones (e.g.
+    a huge code block with no blank lines) are encoded and cut.
+    """
+    if len(text.encode("utf-8")) <= max_tokens:
+        return [text]
+    enc = _encoding()
+    if len(enc.encode_ordinary(text)) <= max_tokens:
+        return [text]
+
+    body = text[len(prefix):] if text.startswith(prefix) else text
+    tokens = enc.encode_ordinary(body)
+    budget = max(1, max_tokens - len(enc.encode_ordinary(prefix)))
+
+    pieces: list[str] = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + budget, len(tokens))
+        # Back off until the window decodes cleanly (a multi-byte character
+        # can span several tokens); the remainder then starts on a boundary.
+        while end > start + 1:
+            try:
+                window = enc.decode_bytes(tokens[start:end]).decode("utf-8")
+                break
+            except UnicodeDecodeError:
+                end -= 1
+        else:
+            window = enc.decode(tokens[start:end])
+        pieces.append(prefix + window)
+        start = end
+    return pieces
+
+
+def chunk_markdown(text: str, max_chars: int = MAX_CHUNK_CHARS) -> tuple[list[str], list[str]]:
     """Split a markdown document into heading-aware chunks.
 
-    Returns a list of dicts with keys: ``text``, ``section``.
+    Returns parallel lists ``(texts, sections)``: the chunk text and the
+    section name it came from, one entry per chunk.
     """
     title = _extract_title(text)
     sections = _split_by_headings(text)
 
-    chunks: list[dict] = []
+    texts: list[str] = []
+    section_names: list[str] = []
 
     for heading, body in sections:
         section_name = heading.lstrip("# ").strip() if heading else "(intro)"
@@ -142,14 +237,70 @@ def chunk_markdown(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list[dict]:
         full_text = "\n\n".join(parts)
 
         if len(full_text) <= max_chars:
-            chunks.append({"text": full_text, "section": section_name})
+            sub_chunks = [full_text]
         else:
             # Section too large — sub-chunk by paragraph
             sub_chunks = _split_section_by_paragraphs(body, title, heading, max_chars)
-            for sub_text in sub_chunks:
-                chunks.append({"text": sub_text, "section": section_name})
 
-    return chunks
+        # Context repeated at the top of every piece if a chunk must be cut by tokens
+        prefix = "".join(part + "\n\n" for part in (title, heading) if part)
+
+        for sub_text in sub_chunks:
+            # A single paragraph can still exceed the embedding model's limit
+            pieces = _split_by_tokens(sub_text, MAX_CHUNK_TOKENS, prefix)
+            texts.extend(pieces)
+            section_names.extend([section_name] * len(pieces))
+
+    return texts, section_names
+
+
+def _embed_batch(openai_client: OpenAI, texts: list[str]) -> list[list[float]]:
+    """Embed one batch of texts with a single OpenAI embeddings call."""
+    # Small jitter so concurrent batches don't hit the OpenAI API all at once
+    time.sleep(random.uniform(0, 0.1))
+    resp = openai_client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+
+def _embedding_batches(texts: list[str]) -> list[list[str]]:
+    """Group ``texts`` into consecutive batches within OpenAI's per-request limits.
+
+    Each batch holds at most ``EMBED_MAX_INPUTS`` texts and
+    ``EMBED_MAX_TOKENS`` tokens in total. Chunks are capped at
+    ``MAX_CHUNK_TOKENS``, so every text fits in a batch on its own.
+
+    As in ``_split_by_tokens``, a text's UTF-8 byte length bounds its token
+    count, so texts are only tokenized when that bound would overflow the
+    current batch.
+    """
+    batches: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for text in texts:
+        n_tokens = len(text.encode("utf-8"))
+        if current_tokens + n_tokens > EMBED_MAX_TOKENS:
+            n_tokens = len(_encoding().encode_ordinary(text))
+        if current and (len(current) >= EMBED_MAX_INPUTS or current_tokens + n_tokens > EMBED_MAX_TOKENS):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_texts(openai_client: OpenAI, texts: list[str]) -> list[list[float]]:
+    """Embed ``texts`` via the OpenAI embeddings API, preserving input order.
+
+    Texts are sent in batches sized by ``_embedding_batches``, with up to
+    ``EMBED_WORKERS`` batches in flight at once.
+    """
+    batches = _embedding_batches(texts)
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+        results = executor.map(lambda batch: _embed_batch(openai_client, batch), batches)
+        return [embedding for batch in results for embedding in batch]
 
 
 def ingest():
@@ -177,32 +328,38 @@ def ingest():
     all_metadatas: list[dict] = []
 
     for doc in documents:
-        chunks = chunk_markdown(doc["content"])
-        logger.info("  %s: %d chunk(s)", doc["relative_path"], len(chunks))
-        for i, chunk in enumerate(chunks):
+        texts, sections = chunk_markdown(doc["content"])
+        logger.info("  %s: %d chunk(s)", doc["relative_path"], len(texts))
+        all_chunks.extend(texts)
+        for i, section in enumerate(sections):
             all_ids.append(f"{doc['relative_path']}::chunk{i}")
-            all_chunks.append(chunk["text"])
             all_metadatas.append({
                 "source": doc["relative_path"],
                 "filename": doc["filename"],
                 "chunk_index": i,
-                "section": chunk["section"],
+                "section": section,
             })
 
     logger.info("Total chunks: %d", len(all_chunks))
 
-    # Initialize ChromaDB with OpenAI embeddings
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         logger.error("OPENAI_API_KEY environment variable is not set")
         sys.exit(1)
 
+    # Embed before touching Chroma so a failed run leaves the existing index intact
+    all_embeddings = embed_texts(OpenAI(api_key=api_key), all_chunks)
+
+    # Initialize ChromaDB with OpenAI embeddings
     embedding_fn = OpenAIEmbeddingFunction(
         api_key=api_key,
         model_name=EMBEDDING_MODEL,
     )
 
-    client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+    if CHROMA_HOST:
+        client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    else:
+        client = chromadb.PersistentClient(path=str(CHROMA_DIR))
     # Delete existing collection to do a clean re-ingest
     try:
         client.delete_collection(COLLECTION_NAME)
@@ -214,17 +371,23 @@ def ingest():
         embedding_function=embedding_fn,
     )
 
-    # Upsert in batches of 100 (Chroma's recommended batch size)
-    batch_size = 100
-    for i in range(0, len(all_chunks), batch_size):
-        end = min(i + batch_size, len(all_chunks))
-        collection.upsert(
-            ids=all_ids[i:end],
-            documents=all_chunks[i:end],
-            metadatas=all_metadatas[i:end],
-        )
-
-    logger.info("Ingested %d chunks into ChromaDB at %s", collection.count(), CHROMA_DIR)
+    # Upsert batches concurrently; they are independent since upsert is keyed by id
+    with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+        futures = []
+        for i in range(0, len(all_chunks), UPSERT_BATCH_SIZE):
+            end = min(i + UPSERT_BATCH_SIZE, len(all_chunks))
+            futures.append(executor.submit(
+                collection.upsert,
+                ids=all_ids[i:end],
+                documents=all_chunks[i:end],
+                embeddings=all_embeddings[i:end],
+                metadatas=all_metadatas[i:end],
+            ))
+        for future in as_completed(futures):
+            future.result()  # re-raise any upsert failure
+
+    location = f"{CHROMA_HOST}:{CHROMA_PORT}" if CHROMA_HOST else CHROMA_DIR
+    logger.info("Ingested %d chunks into ChromaDB at %s", collection.count(), location)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
 """FastAPI server for the RAG docs assistant.
 
 Exposes endpoints for semantic retrieval (/retrieve), retrieval + LLM
-generation (/query), retrieval diagnostics (/debug-query), and a doc
-browser API (/api/docs). Uses ChromaDB for vector search and OpenAI
-for embeddings and completions.
+generation (/query, streamed via /query/stream), retrieval diagnostics
+(/debug-query), and a doc browser API (/api/docs). Uses ChromaDB for
+vector search and OpenAI for embeddings and completions.
 """
 
+import asyncio
 import os
+import time
+from functools import lru_cache
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -15,10 +18,12 @@ ENV_FILE = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(ENV_FILE)
 
 import chromadb
+import orjson
 from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from openai import OpenAI
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
@@ -26,11 +31,15 @@ from slowapi.util import get_remote_address
 
 CHROMA_DIR = Path(__file__).resolve().parent.parent / "chroma_db"
 DOCS_DIR = Path(__file__).resolve().parent.parent / "docs"
+DOCS_DIR_RESOLVED = DOCS_DIR.resolve()
 COLLECTION_NAME = "internal_docs"
+CHROMA_HOST = os.environ.get("CHROMA_HOST")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
 COMPLETION_MODEL = os.environ.get("COMPLETION_MODEL", "gpt-4o-mini")
+COUNT_TTL_SECONDS = 30.0
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
@@ -60,15 +69,56 @@ embedding_fn = OpenAIEmbeddingFunction(
     model_name=EMBEDDING_MODEL,
 )
 
-openai_client = OpenAI(api_key=api_key, timeout=30.0)
+openai_client = AsyncOpenAI(api_key=api_key, timeout=30.0)
 
-chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+# Use a shared Chroma server when CHROMA_HOST is set so several uvicorn
+# workers can query one DB; otherwise open the local store in-process.
+if CHROMA_HOST:
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+else:
+    chroma_client = chromadb.PersistentClient(path=str(CHROMA_DIR))
 collection = chroma_client.get_or_create_collection(
     name=COLLECTION_NAME,
     embedding_function=embedding_fn,
 )
 
 
+@lru_cache(maxsize=1024)
+def _embed_query(text: str):
+    """Embed a query string, memoized so repeat queries skip the OpenAI round-trip."""
+    return embedding_fn([text])[0]
+
+
+# (monotonic timestamp, collection.count()) — avoids a Chroma round-trip per request
+_count_cache: tuple[float, int] | None = None
+
+
+def _collection_count() -> int:
+    """Return the number of ingested chunks, refreshed at most every ``COUNT_TTL_SECONDS``.
+
+    A zero count is always re-checked so the API starts serving as soon as
+    ingestion finishes.
+    """
+    global _count_cache
+    now = time.monotonic()
+    if _count_cache is None or _count_cache[1] == 0 or now - _count_cache[0] > COUNT_TTL_SECONDS:
+        _count_cache = (now, collection.count())
+    return _count_cache[1]
+
+
+def _search(query: str, n_results: int, include: list[str] | None = None):
+    """Embed ``query`` and run a Chroma similarity search.
+
+    Only documents and distances are fetched unless ``include`` says otherwise.
+    Both steps block on I/O, so endpoints call this via ``asyncio.to_thread``.
+    """
+    return collection.query(
+        query_embeddings=[_embed_query(query)],
+        n_results=n_results,
+        include=include or ["documents", "distances"],
+    )
+
+
 class RetrieveRequest(BaseModel):
     query: str
     top_k: int = Field(default=5, ge=1, le=20)
@@ -92,23 +142,22 @@ def health():
 
 @app.post("/retrieve", response_model=RetrieveResponse)
 @limiter.limit("30/minute")
-def retrieve(req: RetrieveRequest, request: Request):
+async def retrieve(req: RetrieveRequest, request: Request):
     """Return the top-k most similar chunks for a query (retrieval only, no LLM)."""
-    if collection.count() == 0:
+    count = await asyncio.to_thread(_collection_count)
+    if count == 0:
         raise HTTPException(status_code=503, detail="No documents ingested yet. Run: python -m app.ingest")
 
-    results = collection.query(
-        query_texts=[req.query],
-        n_results=min(req.top_k, collection.count()),
-    )
+    results = await asyncio.to_thread(_search, req.query, min(req.top_k, count))
 
+    # Rows come straight from our own Chroma query, so skip per-row validation
     chunks = []
     for doc_id, distance, text in zip(
         results["ids"][0],
         results["distances"][0],
         results["documents"][0],
     ):
-        chunks.append(ChunkResult(
+        chunks.append(ChunkResult.model_construct(
             doc_id=doc_id,
             score=round(1 - distance, 4),  # Chroma returns distance; convert to similarity
             text=text,
@@ -138,21 +187,10 @@ class QueryResponse(BaseModel):
     chunks: list[ChunkResult]
 
 
-@app.post("/query", response_model=QueryResponse)
-@limiter.limit("10/minute")
-def query(req: QueryRequest, request: Request):
-    """Retrieve relevant chunks and generate an LLM answer grounded in them."""
-    if collection.count() == 0:
-        raise HTTPException(status_code=503, detail="No documents ingested yet. Run: python -m app.ingest")
-
-    results = collection.query(
-        query_texts=[req.query],
-        n_results=min(req.top_k, collection.count()),
-    )
-
-    # Build context and chunk results from retrieved chunks
+def _build_context(results) -> tuple[str, list[str], list[ChunkResult]]:
+    """Turn Chroma query results into (LLM context, ordered sources, chunk results)."""
     context_parts = []
-    sources = []
+    sources: dict[str, None] = {}
     chunks = []
     for doc_id, distance, text in zip(
         results["ids"][0],
@@ -161,24 +199,40 @@ def query(req: QueryRequest, request: Request):
     ):
         source = doc_id.split("::")[0]
         context_parts.append(f"[Source: {source}]\n{text}")
-        if source not in sources:
-            sources.append(source)
-        chunks.append(ChunkResult(
+        sources[source] = None  # dict keys: ordered de-dup
+        chunks.append(ChunkResult.model_construct(
             doc_id=doc_id,
             score=round(1 - distance, 4),
             text=text,
         ))
 
-    context = "\n\n---\n\n".join(context_parts)
+    return "\n\n---\n\n".join(context_parts), list(sources), chunks
+
+
+def _chat_messages(context: str, query: str) -> list[dict]:
+    """Build the chat prompt: system prompt with retrieved context, then the user query."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT.format(context=context)},
+        {"role": "user", "content": query},
+    ]
+
+
+@app.post("/query", response_model=QueryResponse)
+@limiter.limit("10/minute")
+async def query(req: QueryRequest, request: Request):
+    """Retrieve relevant chunks and generate an LLM answer grounded in them."""
+    count = await asyncio.to_thread(_collection_count)
+    if count == 0:
+        raise HTTPException(status_code=503, detail="No documents ingested yet. Run: python -m app.ingest")
+
+    results = await asyncio.to_thread(_search, req.query, min(req.top_k, count))
+    context, sources, chunks = _build_context(results)
 
     try:
-        completion = openai_client.chat.completions.create(
+        completion = await openai_client.chat.completions.create(
             model=COMPLETION_MODEL,
             temperature=0.1,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT.format(context=context)},
-                {"role": "user", "content": req.query},
-            ],
+            messages=_chat_messages(context, req.query),
         )
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"LLM request failed: {e}")
@@ -190,6 +244,54 @@ def query(req: QueryRequest, request: Request):
     )
 
 
+def _sse(payload: dict) -> bytes:
+    """Encode one server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.post("/query/stream")
+@limiter.limit("10/minute")
+async def query_stream(req: QueryRequest, request: Request):
+    """Like ``/query``, but streams the answer as server-sent events.
+
+    The first event carries ``sources`` and ``chunks``, each following event
+    carries a ``delta`` of answer text, and a final ``{"done": true}`` event
+    ends the stream. A failure mid-stream is reported as an ``error`` event.
+    """
+    count = await asyncio.to_thread(_collection_count)
+    if count == 0:
+        raise HTTPException(status_code=503, detail="No documents ingested yet. Run: python -m app.ingest")
+
+    results = await asyncio.to_thread(_search, req.query, min(req.top_k, count))
+    context, sources, chunks = _build_context(results)
+
+    try:
+        stream = await openai_client.chat.completions.create(
+            model=COMPLETION_MODEL,
+            temperature=0.1,
+            messages=_chat_messages(context, req.query),
+            stream=True,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"LLM request failed: {e}")
+
+    async def events():
+        # Entered before the first yield so the upstream response is closed
+        # however the generator ends, including a disconnect at any event
+        async with stream:
+            yield _sse({"sources": sources, "chunks": [c.model_dump() for c in chunks]})
+            try:
+                async for event in stream:
+                    if event.choices and event.choices[0].delta.content:
+                        yield _sse({"delta": event.choices[0].delta.content})
+            except Exception as e:
+                yield _sse({"error": f"LLM request failed: {e}"})
+                return
+            yield _sse({"done": True})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
 class DebugChunk(BaseModel):
     doc_id: str
     section: str
@@ -204,14 +306,16 @@ class DebugQueryResponse(BaseModel):
 
 
 @app.post("/debug-query", response_model=DebugQueryResponse)
-def debug_query(req: RetrieveRequest):
+async def debug_query(req: RetrieveRequest):
     """Return retrieval diagnostics: doc_id, section, chunk_id, score, first 200 chars."""
-    if collection.count() == 0:
+    count = await asyncio.to_thread(_collection_count)
+    if count == 0:
         raise HTTPException(status_code=503, detail="No documents ingested yet. Run: python -m app.ingest")
 
-    results = collection.query(
-        query_texts=[req.query],
-        n_results=min(req.top_k, collection.count()),
+    results = await asyncio.to_thread(
+        _search,
+        req.query,
+        min(req.top_k, count),
         include=["documents", "distances", "metadatas"],
     )
 
@@ -222,7 +326,7 @@ def debug_query(req: RetrieveRequest):
         results["documents"][0],
         results["metadatas"][0],
     ):
-        debug_results.append(DebugChunk(
+        debug_results.append(DebugChunk.model_construct(
             doc_id=doc_id,
             section=meta.get("section", ""),
             chunk_index=meta.get("chunk_index", -1),
@@ -233,11 +337,35 @@ def debug_query(req: RetrieveRequest):
     return DebugQueryResponse(query=req.query, results=debug_results)
 
 
+# (DOCS_DIR mtime_ns, sorted filenames, filename set) — rescanned only when the directory changes
+_docs_list_cache: tuple[int, list[str], frozenset[str]] | None = None
+
+
+def _doc_names() -> tuple[list[str], frozenset[str]]:
+    """Return the sorted ``.md`` filenames in ``DOCS_DIR`` plus a set for membership checks."""
+    global _docs_list_cache
+    try:
+        mtime_ns = DOCS_DIR.stat().st_mtime_ns
+        if _docs_list_cache is None or _docs_list_cache[0] != mtime_ns:
+            with os.scandir(DOCS_DIR) as entries:
+                names = sorted(e.name for e in entries if e.name.endswith(".md") and e.is_file())
+            _docs_list_cache = (mtime_ns, names, frozenset(names))
+    except OSError:
+        # Missing or unreadable docs directory: nothing to list
+        return [], frozenset()
+    return _docs_list_cache[1], _docs_list_cache[2]
+
+
 @app.get("/api/docs")
 def list_docs():
     """Return a list of available documentation filenames."""
-    files = sorted(DOCS_DIR.glob("*.md"))
-    return [f.name for f in files]
+    return _doc_names()[0]
+
+
+@lru_cache(maxsize=128)
+def _read_doc(path: Path, mtime_ns: int) -> str:
+    """Read a doc file; ``mtime_ns`` is part of the cache key so edits are picked up."""
+    return path.read_text(encoding="utf-8")
 
 
 @app.get("/api/docs/{filename}")
@@ -245,12 +373,14 @@ def get_doc(filename: str):
     """Return the raw markdown content of a documentation file."""
     if not filename.endswith(".md") or "/" in filename or "\\" in filename or ".." in filename:
         raise HTTPException(status_code=404, detail="Not found")
+    if filename not in _doc_names()[1]:
+        raise HTTPException(status_code=404, detail="Not found")
     path = (DOCS_DIR / filename).resolve()
-    if not path.is_relative_to(DOCS_DIR.resolve()) or not path.is_file():
+    if not path.is_relative_to(DOCS_DIR_RESOLVED) or not path.is_file():
         raise HTTPException(status_code=404, detail="Not found")
 
     try:
-        md_text = path.read_text(encoding="utf-8")
+        md_text = _read_doc(path, path.stat().st_mtime_ns)
     except UnicodeDecodeError:
         raise HTTPException(status_code=500, detail=f"File encoding error: {filename}")
     return {"filename": filename, "content": md_text}
@@ -1,5 +1,6 @@
 """Retrieval evaluation: checks whether expected docs appear in top_k results."""
 
+import asyncio
 import os
 
 import httpx
@@ -20,14 +21,18 @@ CASES = [
 ]
 
 
-def run_eval() -> None:
-    client = httpx.Client(base_url=API_BASE, timeout=30)
+async def run_eval() -> None:
+    # Cases are independent, so issue all retrieve calls concurrently
+    async with httpx.AsyncClient(base_url=API_BASE, timeout=30) as client:
+        responses = await asyncio.gather(*[
+            client.post("/retrieve", json={"query": question, "top_k": TOP_K})
+            for question, _ in CASES
+        ])
 
     hits = 0
     rows: list[tuple[str, str, bool, str]] = []
 
-    for question, expected in CASES:
-        resp = client.post("/retrieve", json={"query": question, "top_k": TOP_K})
+    for (question, expected), resp in zip(CASES, responses):
         resp.raise_for_status()
         results = resp.json()["results"]
 
@@ -55,4 +60,4 @@ def run_eval() -> None:
 
 
 if __name__ == "__main__":
-    run_eval()
\ No newline at end of file
+    asyncio.run(run_eval())
\ No newline at end of file
@@ -0,0 +1,169 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from backend.app.ingest import (
+    _embedding_batches,
+    _extract_title,
+    _split_by_tokens,
+    chunk_markdown,
+    embed_texts,
+    load_markdown_files,
+)
+
+# --- _extract_title ---
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("# Title\n\nBody", "# Title"),
+    ("Intro\n\n  # Indented Title  \n", "# Indented Title"),
+    ("## Section\n\n# Real Title", "# Real Title"),
+    ("#NoSpace\n#   \n", ""),
+    ("No headings at all", ""),
+    ("# Title\r\nBody", "# Title"),
+])
+def test_extract_title(text, expected):
+    assert _extract_title(text) == expected
+
+
+# --- chunk_markdown ---
+
+
+def test_chunk_markdown_splits_on_headings():
+    text = "# Doc\n\nIntro text.\n\n## First\n\nOne.\n\n## Second\n\nTwo."
+    texts, sections = chunk_markdown(text)
+    assert sections == ["(intro)", "First", "Second"]
+    assert texts[1] == "# Doc\n\n## First\n\nOne."
+
+
+def test_chunk_markdown_subchunks_large_section():
+    paragraphs = "\n\n".join(f"Paragraph {i} " + "x" * 80 for i in range(10))
+    text = f"# Doc\n\n## Big\n\n{paragraphs}"
+    texts, sections = chunk_markdown(text, max_chars=300)
+    assert len(texts) == len(sections)
+    big = [t for t, s in zip(texts, sections) if s == "Big"]
+    assert len(big) > 1
+    for chunk in big:
+        assert chunk.startswith("# Doc\n\n## Big\n\n")
+        assert len(chunk) <= 300
+
+
+def test_chunk_markdown_collapses_extra_blank_lines():
+    body = "\n\n\n".join("y" * 60 for _ in range(4)) + "\n\n\n\n\n" + "z" * 60
+    texts, _ = chunk_markdown(f"## Sec\n\n{body}", max_chars=100)
+    assert texts == [
+        "## Sec\n\n" + "y" * 60,
+        "## Sec\n\n" + "y" * 60,
+        "## Sec\n\n" + "y" * 60,
+        "## Sec\n\n" + "y" * 60,
+        "## Sec\n\n" + "z" * 60,
+    ]
+
+
+class _ByteEncoding:
+    """Stand-in tokenizer with one token per UTF-8 byte."""
+
+    def encode_ordinary(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="replace")
+
+
+@patch("backend.app.ingest._encoding", return_value=_ByteEncoding())
+def test_split_by_tokens(mock_encoding):
+    assert _split_by_tokens("short", max_tokens=10) == ["short"]
+    mock_encoding.assert_not_called()
+    assert _split_by_tokens("a" * 25, max_tokens=10) == ["a" * 10, "a" * 10, "a" * 5]
+
+
+@patch("backend.app.ingest._encoding", return_value=_ByteEncoding())
+def test_split_by_tokens_keeps_multibyte_characters_whole(_encoding):
+    pieces = _split_by_tokens("é" * 30, max_tokens=15)
+    assert all(len(p.encode("utf-8")) <= 15 for p in pieces)
+    assert all("\ufffd" not in p for p in pieces)
+    assert "".join(pieces) == "é" * 30
+
+
+@patch("backend.app.ingest._encoding", return_value=_ByteEncoding())
+@patch("backend.app.ingest.MAX_CHUNK_TOKENS", 50)
+def test_chunk_markdown_enforces_token_limit(_encoding):
+    prefix = "# Doc\n\n## Code\n\n"
+    texts, sections = chunk_markdown("# Doc\n\n## Code\n\n" + "x" * 120, max_chars=1000)
+    pieces = [t for t, s in zip(texts, sections) if s == "Code"]
+    assert len(pieces) > 1
+    assert all(len(p) <= 50 for p in pieces)
+    assert all(p.startswith(prefix) for p in pieces)
+    assert "".join(p[len(prefix):] for p in pieces) == "x" * 120
+
+
+# --- load_markdown_files ---
+
+
+def test_load_markdown_files_sorted(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "b.md").write_text("# B", encoding="utf-8")
+    (tmp_path / "a.md").write_text("# A", encoding="utf-8")
+    (tmp_path / "sub" / "c.md").write_text("# C", encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("ignored", encoding="utf-8")
+
+    docs = load_markdown_files(tmp_path)
+    assert [d["relative_path"] for d in docs] == ["a.md", "b.md", "sub/c.md"]
+    assert [d["content"] for d in docs] == ["# A", "# B", "# C"]
+    assert docs[2]["filename"] == "c.md"
+
+
+def test_load_markdown_files_empty(tmp_path):
+    assert load_markdown_files(tmp_path) == []
+
+
+# --- embed_texts ---
+
+
+def _fake_embeddings_create(model, input):
+    # Return items out of order to check embed_texts re-sorts by index
+    data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+    return SimpleNamespace(data=list(reversed(data)))
+
+
+@patch("backend.app.ingest.time.sleep")
+@patch("backend.app.ingest.EMBED_MAX_INPUTS", 2)
+def test_embed_texts_batches_and_preserves_order(_sleep):
+    client = MagicMock()
+    client.embeddings.create.side_effect = _fake_embeddings_create
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+
+    assert embed_texts(client, texts) == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert client.embeddings.create.call_count == 3
+
+
+@patch("backend.app.ingest._encoding", return_value=_ByteEncoding())
+@patch("backend.app.ingest.EMBED_MAX_TOKENS", 10)
+def test_embedding_batches_respect_token_budget(_encoding):
+    texts = ["a" * 6, "b" * 4, "c" * 3, "d" * 10, "e"]
+    assert _embedding_batches(texts) == [["a" * 6, "b" * 4], ["c" * 3], ["d" * 10], ["e"]]
+
+
+@patch("backend.app.ingest._encoding")
+def test_embedding_batches_skip_tokenizer_for_small_inputs(mock_encoding):
+    assert _embedding_batches(["short", "texts"]) == [["short", "texts"]]
+    mock_encoding.assert_not_called()
+
+
+class _HalfTokenEncoding(_ByteEncoding):
+    """Two bytes per token, so byte length overestimates the token count."""
+
+    def encode_ordinary(self, text):
+        return list(range(len(text.encode("utf-8")) // 2))
+
+
+@patch("backend.app.ingest._encoding", return_value=_HalfTokenEncoding())
+@patch("backend.app.ingest.EMBED_MAX_TOKENS", 10)
+def test_embedding_batches_tokenize_only_near_budget(mock_encoding):
+    # 6 + 8 bytes overflows the byte bound, but "b" * 8 is really 4 tokens
+    assert _embedding_batches(["a" * 6, "b" * 8]) == [["a" * 6, "b" * 8]]
+    assert mock_encoding.call_count == 1
@@ -1,12 +1,14 @@
+import asyncio
+import json
 import os
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 os.environ.setdefault("OPENAI_API_KEY", "test-key")
 
 import pytest
 from fastapi.testclient import TestClient
 
-from backend.app.main import app
+from backend.app.main import QueryRequest, _embed_query, app, query_stream
 
 # Disable rate limiting in tests
 app.state.limiter._default_limits = []
@@ -24,6 +26,19 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def reset_count_cache():
+    with patch("backend.app.main._count_cache", None):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def mock_embedding_fn():
+    _embed_query.cache_clear()
+    with patch("backend.app.main.embedding_fn", return_value=[[0.1, 0.2, 0.3]]) as mock_fn:
+        yield mock_fn
+
+
 # --- Health ---
 
 
@@ -45,6 +60,22 @@ def test_list_docs(client):
     assert all(name.endswith(".md") for name in data)
 
 
+def test_list_docs_refreshes_on_change(client, tmp_path):
+    (tmp_path / "a.md").write_text("# A", encoding="utf-8")
+    with patch("backend.app.main.DOCS_DIR", tmp_path), patch("backend.app.main._docs_list_cache", None):
+        assert client.get("/api/docs").json() == ["a.md"]
+        (tmp_path / "b.md").write_text("# B", encoding="utf-8")
+        os.utime(tmp_path, ns=(0, tmp_path.stat().st_mtime_ns + 1))
+        assert client.get("/api/docs").json() == ["a.md", "b.md"]
+
+
+def test_list_docs_missing_dir(client, tmp_path):
+    with patch("backend.app.main.DOCS_DIR", tmp_path / "missing"), patch("backend.app.main._docs_list_cache", None):
+        res = client.get("/api/docs")
+    assert res.status_code == 200
+    assert res.json() == []
+
+
 def test_get_doc_valid(client):
     res = client.get("/api/docs/onboarding.md")
     assert res.status_code == 200
@@ -64,6 +95,31 @@ def test_get_doc_path_traversal(client, filename):
     assert res.status_code == 404
 
 
+def test_get_doc_picks_up_edits(client, tmp_path):
+    doc = tmp_path / "guide.md"
+    doc.write_text("v1", encoding="utf-8")
+    with (
+        patch("backend.app.main.DOCS_DIR", tmp_path),
+        patch("backend.app.main.DOCS_DIR_RESOLVED", tmp_path.resolve()),
+        patch("backend.app.main._docs_list_cache", None),
+    ):
+        assert client.get("/api/docs/guide.md").json()["content"] == "v1"
+        doc.write_text("v2", encoding="utf-8")
+        os.utime(doc, ns=(0, doc.stat().st_mtime_ns + 1))
+        assert client.get("/api/docs/guide.md").json()["content"] == "v2"
+
+
+def test_get_doc_missing_dir(client, tmp_path):
+    missing = tmp_path / "missing"
+    with (
+        patch("backend.app.main.DOCS_DIR", missing),
+        patch("backend.app.main.DOCS_DIR_RESOLVED", missing.resolve()),
+        patch("backend.app.main._docs_list_cache", None),
+    ):
+        res = client.get("/api/docs/onboarding.md")
+    assert res.status_code == 404
+
+
 def test_get_doc_not_found(client):
     res = client.get("/api/docs/nonexistent-file.md")
     assert res.status_code == 404
@@ -82,6 +138,35 @@ def test_retrieve(mock_col, client):
     assert len(data["results"]) == 2
     assert data["results"][0]["doc_id"] == "onboarding.md::chunk0"
     assert data["results"][0]["score"] == 0.8
+    assert mock_col.query.call_args.kwargs["include"] == ["documents", "distances"]
+
+
+@patch("backend.app.main.collection")
+def test_retrieve_caches_query_embedding(mock_col, client, mock_embedding_fn):
+    mock_col.count.return_value = 5
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    for _ in range(2):
+        res = client.post("/retrieve", json={"query": "How do I onboard?"})
+        assert res.status_code == 200
+    mock_embedding_fn.assert_called_once_with(["How do I onboard?"])
+    assert mock_col.query.call_args.kwargs["query_embeddings"] == [[0.1, 0.2, 0.3]]
+
+
+@patch("backend.app.main.collection")
+def test_retrieve_caches_collection_count(mock_col, client):
+    mock_col.count.return_value = 5
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    for _ in range(2):
+        assert client.post("/retrieve", json={"query": "test"}).status_code == 200
+    mock_col.count.assert_called_once()
+
+
+@patch("backend.app.main.collection")
+def test_retrieve_rechecks_empty_collection(mock_col, client):
+    mock_col.count.side_effect = [0, 5]
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    assert client.post("/retrieve", json={"query": "test"}).status_code == 503
+    assert client.post("/retrieve", json={"query": "test"}).status_code == 200
 
 
 @patch("backend.app.main.collection")
@@ -101,13 +186,13 @@ def test_query(mock_col, mock_openai, client):
     mock_col.query.return_value = MOCK_QUERY_RESULTS
     choice = MagicMock()
     choice.message.content = "Mocked answer."
-    mock_openai.chat.completions.create.return_value = MagicMock(choices=[choice])
+    mock_openai.chat.completions.create = AsyncMock(return_value=MagicMock(choices=[choice]))
 
     res = client.post("/query", json={"query": "How do I onboard?"})
     assert res.status_code == 200
     data = res.json()
     assert data["answer"] == "Mocked answer."
-    assert "onboarding.md" in data["sources"]
+    assert data["sources"] == ["onboarding.md"]
     assert len(data["chunks"]) == 2
 
 
@@ -123,8 +208,85 @@ def test_query_empty_collection(mock_col, client):
 def test_query_openai_failure(mock_col, mock_openai, client):
     mock_col.count.return_value = 5
     mock_col.query.return_value = MOCK_QUERY_RESULTS
-    mock_openai.chat.completions.create.side_effect = Exception("API timeout")
+    mock_openai.chat.completions.create = AsyncMock(side_effect=Exception("API timeout"))
 
     res = client.post("/query", json={"query": "test"})
     assert res.status_code == 503
     assert "LLM request failed" in res.json()["detail"]
+
+
+# --- /query/stream ---
+
+
+class _FakeStream:
+    """Minimal stand-in for openai's AsyncStream."""
+
+    def __init__(self, *deltas):
+        self.deltas = deltas
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def __aiter__(self):
+        for delta in self.deltas:
+            choice = MagicMock()
+            choice.delta.content = delta
+            yield MagicMock(choices=[choice])
+
+
+def _sse_events(res):
+    return [json.loads(line[len("data: "):]) for line in res.text.split("\n\n") if line]
+
+
+@patch("backend.app.main.openai_client")
+@patch("backend.app.main.collection")
+def test_query_stream(mock_col, mock_openai, client):
+    mock_col.count.return_value = 5
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    stream = _FakeStream("Mocked ", None, "answer.")
+    mock_openai.chat.completions.create = AsyncMock(return_value=stream)
+
+    res = client.post("/query/stream", json={"query": "How do I onboard?"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(res)
+    assert events[0]["sources"] == ["onboarding.md"]
+    assert len(events[0]["chunks"]) == 2
+    assert events[1:] == [{"delta": "Mocked "}, {"delta": "answer."}, {"done": True}]
+    assert mock_openai.chat.completions.create.call_args.kwargs["stream"] is True
+    assert stream.closed
+
+
+@patch("backend.app.main.openai_client")
+@patch("backend.app.main.collection")
+def test_query_stream_closes_stream_on_early_disconnect(mock_col, mock_openai):
+    mock_col.count.return_value = 5
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    stream = _FakeStream("never sent")
+    mock_openai.chat.completions.create = AsyncMock(return_value=stream)
+
+    async def read_first_event_then_disconnect():
+        res = await query_stream.__wrapped__(QueryRequest(query="test"), request=None)
+        first = await res.body_iterator.__anext__()
+        await res.body_iterator.aclose()
+        return first
+
+    first = asyncio.run(read_first_event_then_disconnect())
+    assert json.loads(first[len(b"data: "):])["sources"] == ["onboarding.md"]
+    assert stream.closed
+
+
+@patch("backend.app.main.openai_client")
+@patch("backend.app.main.collection")
+def test_query_stream_openai_failure(mock_col, mock_openai, client):
+    mock_col.count.return_value = 5
+    mock_col.query.return_value = MOCK_QUERY_RESULTS
+    mock_openai.chat.completions.create = AsyncMock(side_effect=Exception("API timeout"))
+
+    res = client.post("/query/stream", json={"query": "test"})
+    assert res.status_code == 503
+    assert "LLM request failed" in res.json()["detail"]